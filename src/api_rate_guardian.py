@@ -2,11 +2,18 @@
 API Rate Guardian - 核心模块
 """
 import time
+import logging
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Callable
 from dataclasses import dataclass
 from enum import Enum
 
+from checkers import adaptive_interval, backoff_interval
+
+
+log = logging.getLogger("guardian.core")
+
 
 class Provider(Enum):
     OPENAI = "openai"
@@ -24,6 +31,8 @@ class APIConfig:
     base_url: Optional[str] = None
     threshold: int = 80  # 80% 触发预警
     check_interval: int = 60  # 检查间隔（秒）
+    min_interval: Optional[int] = None  # 接近阈值时的最短间隔，默认等于 check_interval
+    max_interval: Optional[int] = None  # 远低于阈值时的最长间隔，默认 check_interval 的 10 倍
 
 
 class NotificationHandler:
@@ -52,7 +61,10 @@ class RateLimitChecker:
         self.notifiers: List[NotificationHandler] = []
         self._running = False
         self._thread = None
-        self._last_warning_time = 0
+        self._last_warning_time: Optional[float] = None  # 单调时钟，不受系统校时影响
+        self._min_interval = config.min_interval or config.check_interval
+        self._max_interval = config.max_interval or config.check_interval * 10
+        self._next_interval = config.check_interval
     
     def add_notifier(self, notifier: NotificationHandler) -> None:
         self.notifiers.append(notifier)
@@ -74,24 +86,38 @@ class RateLimitChecker:
             try:
                 result = self.check_rate_limit()
                 self.usage_percent = result["usage_percent"]
+                self._next_interval = adaptive_interval(
+                    self.usage_percent, self.config.threshold, self._min_interval, self._max_interval
+                )
                 
                 # 触发预警
                 if self.usage_percent >= self.config.threshold:
-                    current_time = time.time()
+                    current_time = time.monotonic()
                     # 防止频繁预警（间隔5分钟）
-                    if current_time - self._last_warning_time > 300:
+                    if self._last_warning_time is None or current_time - self._last_warning_time > 300:
                         self._send_warning(result)
                         self._last_warning_time = current_time
                 
             except Exception as e:
-                print(f"检查出错: {e}")
+                log.error("检查出错: %s", e)
+                # 出错时指数退避
+                self._next_interval = backoff_interval(self._next_interval, self._max_interval)
             
-            time.sleep(self.config.check_interval)
+            time.sleep(self._next_interval)
     
     def _send_warning(self, result: Dict) -> None:
         message = f"⚠️ API 限流预警\n{self.config.provider.value}: {self.usage_percent}% 使用率"
-        for notifier in self.notifiers:
-            notifier.send(message)
+        if not self.notifiers:
+            return
+        
+        # 并发发送，总耗时取决于最慢的通知器，而不是所有通知器耗时之和
+        with ThreadPoolExecutor(max_workers=len(self.notifiers)) as executor:
+            futures = [executor.submit(notifier.send, message) for notifier in self.notifiers]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    log.error("通知失败: %s", e)
     
     def start(self) -> None:
         """启动监控"""
@@ -2,56 +2,202 @@
 API Rate Guardian - 各平台API检查实现
 """
 import os
+import re
 import time
 import json
+import random
+import asyncio
+import hashlib
+import email.utils
 import yaml
-import requests
-from typing import Dict, Optional, Any
+import httpx
+from datetime import datetime
+from typing import Dict, Optional, Any, Mapping, Tuple
 from abc import ABC, abstractmethod
+from functools import cached_property
+
+try:
+    from orjson import dumps as _json_dumps, loads as _json_loads
+except ImportError:
+    def _json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode()
+    
+    _json_loads = json.loads
+
+
+# check() 结果的缓存时间（秒）：短 / 普通 / 长
+CACHE_TTL_SHORT = 5
+CACHE_TTL_NORMAL = 15
+CACHE_TTL_LONG = 30
+
+# 在重置时间点之后再多等一点，避免刚好卡在窗口边界
+RESET_MARGIN = 1.0
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def _parse_reset(value: Any, now: Optional[float] = None) -> Optional[float]:
+    """将重置/重试提示解析为 Unix 时间戳，无法解析时返回 None
+    
+    支持：秒数（相对秒数或 Unix 时间戳）、"6m0s" 形式的时长、RFC 3339、HTTP-date
+    """
+    if value is None or value == "unknown":
+        return None
+    now = time.time() if now is None else now
+    text = str(value).strip()
+    
+    try:
+        seconds = float(text)
+    except ValueError:
+        pass
+    else:
+        # 超过 10 年的秒数只可能是 Unix 时间戳
+        return seconds if seconds > 315360000 else now + seconds
+    
+    parts = _DURATION_RE.findall(text)
+    if parts and "".join(n + u for n, u in parts) == text:
+        return now + sum(float(n) * _DURATION_UNITS[u] for n, u in parts)
+    
+    try:
+        return datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        pass
+    
+    try:
+        return email.utils.parsedate_to_datetime(text).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _next_poll_epoch(headers: Mapping[str, str], remaining: Any, reset: Any) -> Optional[float]:
+    """服务端要求等待（Retry-After）或额度已耗尽时，返回下一次值得轮询的时间点"""
+    retry_at = _parse_reset(headers.get("Retry-After"))
+    if retry_at is not None:
+        return retry_at + RESET_MARGIN
+    
+    # 额度用完后在窗口重置前轮询没有意义，直接等到重置
+    if str(remaining) == "0":
+        reset_at = _parse_reset(reset)
+        if reset_at is not None:
+            return reset_at + RESET_MARGIN
+    return None
+
+
+def _pct(limit_s: Any, remaining_s: Any) -> float:
+    """由限额和剩余量计算使用百分比，无法解析或限额为 0 时返回 0"""
+    try:
+        limit, remaining = int(limit_s), int(remaining_s)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if limit <= 0 else (limit - remaining) * 100.0 / limit
+
+
+def adaptive_interval(usage: float, threshold: float, min_interval: float, max_interval: float) -> float:
+    """根据使用率计算下一次轮询间隔：越接近阈值轮询越快，远低于阈值时放慢，并加入随机抖动避免多个检查器同步"""
+    ratio = min(max(usage / threshold, 0.0), 1.0) if threshold > 0 else 1.0
+    interval = min(max(max_interval * (1 - ratio) ** 2, min_interval), max_interval)
+    return interval * random.uniform(0.8, 1.2)
+
+
+def backoff_interval(current: float, max_interval: float) -> float:
+    """检查失败（含 HTTP 429）时指数退避，上限为 max_interval"""
+    return min(current * 2, max_interval)
 
 
 class BaseChecker(ABC):
     """检查器基类"""
     
+    provider: str = ""
+    cache_ttl: float = CACHE_TTL_NORMAL
+    
+    # (provider, api_key 哈希) -> (过期时间, 结果)，同一个 Key 的检查器共享
+    _cache: Dict[Tuple[str, str], Tuple[float, Dict[str, Any]]] = {}
+    
+    # 以下属性由 APIRateGuardian 根据配置覆盖
+    name: str = ""
+    threshold: int = 80
+    check_interval: int = 60
+    min_interval: float = 60
+    max_interval: float = 600
+    _next_interval: float = 60
+    next_due: float = 0.0  # 下一次检查的时间点，由调度器维护
+    
+    def update_interval(self, usage: float) -> float:
+        """根据使用率更新下一次轮询间隔"""
+        self._next_interval = adaptive_interval(usage, self.threshold, self.min_interval, self.max_interval)
+        return self._next_interval
+    
+    def backoff(self) -> float:
+        """检查失败（含 HTTP 429）时指数退避，上限为 max_interval"""
+        self._next_interval = backoff_interval(self._next_interval, self.max_interval)
+        return self._next_interval
+    
+    def defer_until(self, epoch: Optional[float]) -> float:
+        """服务端给出重置/重试时间时，下一次轮询至少推迟到该时间点"""
+        if epoch is not None:
+            self._next_interval = max(self._next_interval, epoch - time.time())
+        return self._next_interval
+    
+    @cached_property
+    def _cache_key(self) -> Tuple[str, str]:
+        return self.provider, hashlib.sha256(self.api_key.encode()).hexdigest()
+    
+    async def check(self, client: httpx.AsyncClient, force: bool = False) -> Dict[str, Any]:
+        """检查API使用情况（复用调用方传入的 HTTP 客户端）
+        
+        缓存未过期时返回上次结果的副本，并带上 "cached": True，调用方据此避免把同一次探测重复计入历史
+        """
+        now = time.time()
+        cached = self._cache.get(self._cache_key)
+        if not force and cached is not None and cached[0] > now:
+            return {**cached[1], "cached": True}
+        
+        result = await self._probe(client)
+        
+        # 服务端给出了重试/重置时间则缓存到该时间点，否则按 provider 默认时长缓存成功结果
+        next_poll = result.get("next_poll_epoch")
+        if next_poll is not None:
+            self._cache[self._cache_key] = (next_poll, result)
+        elif result.get("status") == "ok":
+            self._cache[self._cache_key] = (now + self.cache_ttl, result)
+        return result
+    
     @abstractmethod
-    def check(self) -> Dict[str, Any]:
-        """检查API使用情况"""
+    async def _probe(self, client: httpx.AsyncClient) -> Dict[str, Any]:
+        """实际请求 API 并解析限流信息"""
         pass
 
 
 class OpenAIChecker(BaseChecker):
     """OpenAI API 检查器"""
     
+    provider = "openai"
+    
     def __init__(self, api_key: str, organization: Optional[str] = None):
         self.api_key = api_key
         self.organization = organization
         self.base_url = "https://api.openai.com/v1"
-    
-    def check(self) -> Dict[str, Any]:
-        headers = {
+        # 请求头固定不变，连接由调用方的会话池复用
+        self.headers = {
             "Authorization": f"Bearer {self.api_key}"
         }
         if self.organization:
-            headers["OpenAI-Organization"] = self.organization
-        
+            self.headers["OpenAI-Organization"] = self.organization
+    
+    async def _probe(self, client: httpx.AsyncClient) -> Dict[str, Any]:
         try:
-            # 使用 Embeddings API 检查限流
-            resp = requests.post(
-                f"{self.base_url}/embeddings",
-                headers=headers,
-                json={"input": "test", "model": "text-embedding-3-small"},
-                timeout=10
+            # 使用免费的模型列表接口读取限流响应头，不消耗 token
+            resp = await client.get(
+                f"{self.base_url}/models",
+                headers=self.headers
             )
             
             remaining = resp.headers.get("X-RateLimit-Limit", "unknown")
             remaining_requests = resp.headers.get("X-RateLimit-Remaining", "unknown")
             reset_time = resp.headers.get("X-RateLimit-Reset", "unknown")
             
-            # 计算使用百分比
-            if remaining_requests != "unknown" and remaining != "unknown":
-                usage_percent = (int(remaining) - int(remaining_requests)) / int(remaining) * 100
-            else:
-                usage_percent = 0
+            usage_percent = _pct(remaining, remaining_requests)
             
             return {
                 "provider": "openai",
@@ -59,6 +205,7 @@ class OpenAIChecker(BaseChecker):
                 "remaining": remaining_requests,
                 "limit": remaining,
                 "reset_time": reset_time,
+                "next_poll_epoch": _next_poll_epoch(resp.headers, remaining_requests, reset_time),
                 "status": "ok" if resp.status_code == 200 else "error"
             }
         except Exception as e:
@@ -72,32 +219,27 @@ class OpenAIChecker(BaseChecker):
 class DeepSeekChecker(BaseChecker):
     """DeepSeek API 检查器"""
     
+    provider = "deepseek"
+    
     def __init__(self, api_key: str):
         self.api_key = api_key
         self.base_url = "https://api.deepseek.com"
-    
-    def check(self) -> Dict[str, Any]:
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}"
         }
-        
+    
+    async def _probe(self, client: httpx.AsyncClient) -> Dict[str, Any]:
         try:
-            resp = requests.post(
-                f"{self.base_url}/v1/chat/completions",
-                headers=headers,
-                json={"model": "deepseek-chat", "messages": [{"role": "user", "content": "hi"}], "max_tokens": 1},
-                timeout=10
+            resp = await client.get(
+                f"{self.base_url}/v1/models",
+                headers=self.headers
             )
             
             remaining = resp.headers.get("X-RateLimit-Remaining-Limit", "unknown")
             remaining_requests = resp.headers.get("X-RateLimit-Remaining-Requests", "unknown")
             reset_time = resp.headers.get("X-RateLimit-Reset-TTokens", "unknown")
             
-            if remaining_requests != "unknown" and remaining != "unknown":
-                usage_percent = (int(remaining) - int(remaining_requests)) / int(remaining) * 100
-            else:
-                usage_percent = 0
+            usage_percent = _pct(remaining, remaining_requests)
             
             return {
                 "provider": "deepseek",
@@ -105,6 +247,7 @@ class DeepSeekChecker(BaseChecker):
                 "remaining": remaining_requests,
                 "limit": remaining,
                 "reset_time": reset_time,
+                "next_poll_epoch": _next_poll_epoch(resp.headers, remaining_requests, reset_time),
                 "status": "ok" if resp.status_code == 200 else "error"
             }
         except Exception as e:
@@ -118,23 +261,26 @@ class DeepSeekChecker(BaseChecker):
 class MiniMaxChecker(BaseChecker):
     """MiniMax API 检查器"""
     
+    provider = "minimax"
+    cache_ttl = CACHE_TTL_LONG  # 探测请求会消耗 token
+    
     def __init__(self, api_key: str, base_url: Optional[str] = None):
         self.api_key = api_key
         self.base_url = base_url or "https://api.minimaxi.com"
-    
-    def check(self) -> Dict[str, Any]:
-        headers = {
+        self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
-        
+        # 探测请求体固定不变，只序列化一次
+        self._body = _json_dumps({"model": "MiniMax-M2.1", "messages": [{"role": "user", "content": "hi"}], "max_tokens": 1})
+    
+    async def _probe(self, client: httpx.AsyncClient) -> Dict[str, Any]:
         try:
             # MiniMax 使用 Anthropic 兼容 API
-            resp = requests.post(
+            resp = await client.post(
                 f"{self.base_url}/anthropic/v1/messages",
-                headers=headers,
-                json={"model": "MiniMax-M2.1", "messages": [{"role": "user", "content": "hi"}], "max_tokens": 1},
-                timeout=10
+                headers=self.headers,
+                content=self._body
             )
             
             # MiniMax 的响应头
@@ -142,10 +288,7 @@ class MiniMaxChecker(BaseChecker):
             remaining_requests = resp.headers.get("X-RateLimit-Remaining", "unknown")
             reset_time = resp.headers.get("X-RateLimit-Reset", "unknown")
             
-            if remaining_requests != "unknown" and remaining != "unknown":
-                usage_percent = (int(remaining) - int(remaining_requests)) / int(remaining) * 100
-            else:
-                usage_percent = 0
+            usage_percent = _pct(remaining, remaining_requests)
             
             return {
                 "provider": "minimax",
@@ -153,6 +296,7 @@ class MiniMaxChecker(BaseChecker):
                 "remaining": remaining_requests,
                 "limit": remaining,
                 "reset_time": reset_time,
+                "next_poll_epoch": _next_poll_epoch(resp.headers, remaining_requests, reset_time),
                 "status": "ok" if resp.status_code in [200, 201] else "error"
             }
         except Exception as e:
@@ -166,33 +310,35 @@ class MiniMaxChecker(BaseChecker):
 class AnthropicChecker(BaseChecker):
     """Anthropic (Claude) API 检查器"""
     
-    def __init__(self, api_key: str):
+    provider = "anthropic"
+    cache_ttl = CACHE_TTL_LONG  # 探测请求会消耗 token
+    
+    def __init__(self, api_key: str, model: Optional[str] = None):
         self.api_key = api_key
         self.base_url = "https://api.anthropic.com"
-    
-    def check(self) -> Dict[str, Any]:
-        headers = {
+        # 探测用的模型：默认选最便宜的在售模型，模型下线后可在配置中覆盖
+        self.model = model or "claude-haiku-4-5"
+        self.headers = {
             "x-api-key": self.api_key,
             "anthropic-version": "2023-06-01",
             "Content-Type": "application/json"
         }
-        
+        self._body = _json_dumps({"model": self.model, "messages": [{"role": "user", "content": "hi"}], "max_tokens": 1})
+    
+    async def _probe(self, client: httpx.AsyncClient) -> Dict[str, Any]:
         try:
-            resp = requests.post(
+            # 限流响应头只在 Messages 接口返回，用 max_tokens=1 的最小请求探测
+            resp = await client.post(
                 f"{self.base_url}/v1/messages",
-                headers=headers,
-                json={"model": "claude-3-5-sonnet-20241022", "max, "messages":_tokens": 1 [{"role": "user", "content": "hi"}]},
-                timeout=10
+                headers=self.headers,
+                content=self._body
             )
             
             remaining = resp.headers.get("anthropic-ratelimit-limit", "unknown")
             remaining_requests = resp.headers.get("anthropic-ratelimit-remaining", "unknown")
             reset_time = resp.headers.get("anthropic-ratelimit-reset", "unknown")
             
-            if remaining_requests != "unknown" and remaining != "unknown":
-                usage_percent = (int(remaining) - int(remaining_requests)) / int(remaining) * 100
-            else:
-                usage_percent = 0
+            usage_percent = _pct(remaining, remaining_requests)
             
             return {
                 "provider": "anthropic",
@@ -200,6 +346,7 @@ class AnthropicChecker(BaseChecker):
                 "remaining": remaining_requests,
                 "limit": remaining,
                 "reset_time": reset_time,
+                "next_poll_epoch": _next_poll_epoch(resp.headers, remaining_requests, reset_time),
                 "status": "ok" if resp.status_code in [200, 201] else "error"
             }
         except Exception as e:
@@ -213,25 +360,24 @@ class AnthropicChecker(BaseChecker):
 class GitHubChecker(BaseChecker):
     """GitHub API 检查器"""
     
+    provider = "github"
+    cache_ttl = CACHE_TTL_SHORT  # /rate_limit 不计入配额，可以更频繁地刷新
+    
     def __init__(self, api_key: str):
         self.api_key = api_key
         self.base_url = "https://api.github.com"
-    
-    def check(self) -> Dict[str, Any]:
-        headers = {
+        self.headers = {
             "Authorization": f"token {self.api_key}",
             "Accept": "application/vnd.github+json"
         }
-        
+    
+    async def _probe(self, client: httpx.AsyncClient) -> Dict[str, Any]:
         try:
-            resp = requests.get(f"{self.base_url}/rate_limit", headers=headers, timeout=10)
-            data = resp.json()
-            
-            core_limit = data["resources"]["core"]["limit"]
-            core_remaining = data["resources"]["core"]["remaining"]
-            core_reset = data["resources"]["core"]["reset"]
+            resp = await client.get(f"{self.base_url}/rate_limit", headers=self.headers)
+            core = _json_loads(resp.content)["resources"]["core"]
+            core_limit, core_remaining, core_reset = core["limit"], core["remaining"], core["reset"]
             
-            usage_percent = (core_limit - core_remaining) / core_limit * 100
+            usage_percent = _pct(core_limit, core_remaining)
             
             return {
                 "provider": "github",
@@ -239,6 +385,7 @@ class GitHubChecker(BaseChecker):
                 "remaining": core_remaining,
                 "limit": core_limit,
                 "reset_time": core_reset,
+                "next_poll_epoch": _next_poll_epoch(resp.headers, core_remaining, core_reset),
                 "status": "ok" if resp.status_code == 200 else "error"
             }
         except Exception as e:
@@ -249,21 +396,88 @@ class GitHubChecker(BaseChecker):
             }
 
 
+class PassiveChecker(BaseChecker):
+    """被动检查器：不主动探测，由业务代码在真实请求后通过 ingest() 上报响应头"""
+    
+    def __init__(self, provider: str, limit_header: str = "X-RateLimit-Limit",
+                 remaining_header: str = "X-RateLimit-Remaining", reset_header: str = "X-RateLimit-Reset"):
+        self.provider = provider
+        self.api_key = ""
+        self.limit_header = limit_header.lower()
+        self.remaining_header = remaining_header.lower()
+        self.reset_header = reset_header.lower()
+        self.event: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._latest: Optional[Dict[str, Any]] = None
+    
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        """绑定调度器的事件循环，之后可以在任意线程调用 ingest()"""
+        # 先创建事件再公开事件循环，并发的 ingest() 看到 _loop 时 event 一定已就绪
+        self.event = asyncio.Event()
+        self._loop = loop
+        if self._latest is not None:
+            self.event.set()
+    
+    def ingest(self, headers: Mapping[str, str]) -> None:
+        """由客户端中间件在每次真实请求后调用，传入响应头"""
+        lowered = {k.lower(): v for k, v in headers.items()}
+        remaining = lowered.get(self.limit_header)
+        remaining_requests = lowered.get(self.remaining_header)
+        if remaining is None or remaining_requests is None:
+            # 非 API 接口或部分错误响应不带限流头，忽略，避免记下虚假的 0% 采样
+            return
+        reset_time = lowered.get(self.reset_header, "unknown")
+        
+        usage_percent = _pct(remaining, remaining_requests)
+        
+        self._latest = {
+            "provider": self.provider,
+            "usage_percent": usage_percent,
+            "remaining": remaining_requests,
+            "limit": remaining,
+            "reset_time": reset_time,
+            "status": "ok"
+        }
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:
+            # 调度器已停止、事件循环已关闭：只保留最新结果，不把异常抛进业务代码
+            pass
+    
+    async def check(self, client: httpx.AsyncClient, force: bool = False) -> Dict[str, Any]:
+        """返回最近一次上报的结果，不发起任何请求"""
+        return await self._probe(client)
+    
+    async def _probe(self, client: httpx.AsyncClient) -> Dict[str, Any]:
+        if self._latest is None:
+            return {
+                "provider": self.provider,
+                "status": "error",
+                "error": "尚未收到响应头"
+            }
+        return self._latest
+
+
+# provider 名称 -> 检查器类
+_CHECKERS = {
+    "openai": OpenAIChecker,
+    "deepseek": DeepSeekChecker,
+    "minimax": MiniMaxChecker,
+    "anthropic": AnthropicChecker,
+    "github": GitHubChecker,
+}
+
+
 def get_checker(provider: str, api_key: str, **kwargs) -> BaseChecker:
     """工厂函数：获取对应的检查器"""
-    checkers = {
-        "openai": OpenAIChecker,
-        "deepseek": DeepSeekChecker,
-        "minimax": MiniMaxChecker,
-        "anthropic": AnthropicChecker,
-        "github": GitHubChecker,
-    }
-    
-    provider_lower = provider.lower()
-    if provider_lower not in checkers:
+    cls = _CHECKERS.get(provider.lower())
+    if cls is None:
         raise ValueError(f"不支持的 provider: {provider}")
     
-    return checkers[provider_lower](api_key, **kwargs)
+    return cls(api_key, **kwargs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+"""
+API Rate Guardian - 使用率历史记录
+"""
+import numpy as np
+from typing import Tuple
+
+# 守护进程大部分时间在休眠，numba 的并行线程池在部分平台上会在两次调用之间忙等占满 CPU。
+# trend() 是单线程的 @njit，不会启动线程池；这里不修改 NUMBA_NUM_THREADS / OMP_WAIT_POLICY，
+# 以免影响嵌入本模块的宿主应用
+
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        """未安装 numba 时退化为普通 Python 函数"""
+        def decorator(func):
+            return func
+        return decorator
+
+
+class UsageHistory:
+    """使用率环形缓冲区，每个采样点只占 1 字节（uint8）"""
+    
+    def __init__(self, size: int = 1440):
+        # 默认 1440 个采样点，按每分钟一次约为 24 小时
+        self._buffer = np.zeros(size, dtype=np.uint8)
+        self._index = 0
+        self._count = 0
+    
+    def append(self, usage: float) -> None:
+        """记录一次使用率（百分比），超出 0-255 的部分截断"""
+        self._buffer[self._index] = min(max(int(usage), 0), 255)
+        self._index = (self._index + 1) % self._buffer.size
+        self._count = min(self._count + 1, self._buffer.size)
+    
+    def values(self) -> np.ndarray:
+        """按时间顺序返回已记录的采样点（最旧在前）"""
+        if self._count < self._buffer.size:
+            return self._buffer[:self._count]
+        return np.concatenate((self._buffer[self._index:], self._buffer[:self._index]))
+    
+    def mean(self) -> float:
+        """已记录采样点的平均使用率"""
+        if self._count == 0:
+            return 0.0
+        return float(np.mean(self._buffer[:self._count]))
+    
+    def __len__(self) -> int:
+        return self._count
+
+
+# 单次调用只处理最多几十个采样点，保持单线程编译，不要改成 parallel=True / prange：
+# 并行版本会常驻工作线程，收益远小于空闲时的 CPU 占用
+@njit(cache=True)
+def trend(history: np.ndarray, threshold: int) -> Tuple[float, float, int]:
+    """一次遍历计算平均使用率、线性回归斜率（每个采样点的变化量）和向上穿越阈值的次数
+    
+    history 按时间顺序排列（最旧在前）。循环保持显式写法，numba 可以直接编译为向量化代码。
+    """
+    n = history.size
+    if n == 0:
+        return 0.0, 0.0, 0
+    
+    sum_y = 0.0
+    sum_xy = 0.0
+    crossings = 0
+    for i in range(n):
+        y = float(history[i])
+        sum_y += y
+        sum_xy += i * y
+        if i > 0 and history[i - 1] < threshold and history[i] >= threshold:
+            crossings += 1
+    
+    mean = sum_y / n
+    if n < 2:
+        return mean, 0.0, crossings
+    
+    # x = 0..n-1 的和与平方和有闭式解
+    sum_x = n * (n - 1) / 2.0
+    sum_xx = (n - 1) * n * (2 * n - 1) / 6.0
+    slope = (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x * sum_x)
+    return mean, slope, crossings
+
+
+def warm_up() -> None:
+    """用与运行时相同的参数类型调用一次 trend()，提前完成 JIT 编译（未安装 numba 时几乎无开销）"""
+    trend(np.zeros(2, dtype=np.uint8), 0)
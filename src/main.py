@@ -2,18 +2,99 @@
 API Rate Guardian - 主程序
 """
 import os
+import re
 import sys
+import copy
 import time
+import queue
+import atexit
+import logging
+import functools
 import signal
 import argparse
 import yaml
-import threading
+import asyncio
+import httpx
 from pathlib import Path
-from typing import Dict, Any, List
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Any, List, Optional, Set, Awaitable
 
-from checkers import get_checker, BaseChecker
+from checkers import get_checker, BaseChecker, PassiveChecker
+from history import UsageHistory, trend, warm_up
 from notifiers import NotificationManager, create_notifier, Notifier
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+log = logging.getLogger("guardian")
+
+# 配置中的 ${VAR} 环境变量占位符
+_ENV_RE = re.compile(r"\$\{([^}]+)\}")
+
+
+# 趋势预警：取最近 TREND_WINDOW 个采样点拟合，外推 TREND_HORIZON 次检查后是否会超过阈值
+TREND_WINDOW = 30
+TREND_HORIZON = 5
+# 外推值回落到阈值以下这么多个百分点后才解除趋势预警的冷却，避免在临界点附近反复预警
+TREND_HYSTERESIS = 10
+
+# 预警消息模板，只在发送时填入变化的字段
+_WARNING_TEMPLATE = """
+API: {name}
+使用率: {usage:.1f}%
+剩余: {remaining}
+限制: {limit}
+
+时间: {ts}
+"""
+
+
+def _expand_env(match: re.Match) -> str:
+    return os.environ.get(match.group(1), match.group(0))
+
+
+@functools.lru_cache(maxsize=1)
+def _format_timestamp(second: int) -> str:
+    """同一秒内的多次预警复用格式化好的时间字符串"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+
+
+def _setup_logging(config: Dict) -> None:
+    """配置日志（默认 WARNING）。实际输出在后台线程完成，监控循环里记录日志只是一次入队"""
+    formatter = logging.Formatter("%(asctime)s %(levelname)s %(message)s")
+    handlers: List[logging.Handler] = [logging.StreamHandler()]
+    if config.get("file"):
+        handlers.append(logging.FileHandler(config["file"], encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    logging.basicConfig(
+        level=str(config.get("level", "WARNING")).upper(),
+        format="%(message)s",  # 完整格式由后台线程的处理器负责
+        handlers=[QueueHandler(log_queue)],
+        force=True
+    )
+
+
+@functools.lru_cache(maxsize=8)
+def _load_yaml(path: str, mtime_ns: int) -> Any:
+    """解析 YAML 文件，按 (路径, 修改时间) 缓存，文件未改动时不重复解析"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return yaml.load(f, Loader=SafeLoader)
+
 
 class APIRateGuardian:
     """API 限流预警主类"""
@@ -24,32 +105,51 @@ class APIRateGuardian:
         self.checkers: List[BaseChecker] = []
         self.notification_manager = NotificationManager()
         self.running = False
-        self.threads: List[threading.Thread] = []
-        self._last_warning: Dict[str, float] = {}  # 记录每个API的最后警告时间
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop_event: Optional[asyncio.Event] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._warning_lock: Optional[asyncio.Lock] = None  # 在事件循环内创建
+        self._polled: List[BaseChecker] = []  # 需要主动轮询的检查器
+        self._history: Dict[int, UsageHistory] = {}  # id(checker) -> 使用率历史
+        self._last_warning: Dict[int, float] = {}  # id(checker) -> 最后警告时间（单调时钟）
+        self._last_trend_warning: Dict[int, float] = {}  # id(checker) -> 最后趋势预警时间，与超限预警分开冷却
+        self._pending: Set[asyncio.Future] = set()  # 正在后台发送的通知
+        self._ready = False
     
     def _load_config(self) -> Dict:
         """加载配置文件"""
         config_path = Path(self.config_path)
         if not config_path.exists():
-            print(f"配置文件不存在: {self.config_path}")
+            log.error("配置文件不存在: %s", self.config_path)
             sys.exit(1)
         
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f)
+        # 缓存的是原始配置树，取副本后再替换环境变量，避免污染缓存
+        config = copy.deepcopy(_load_yaml(str(config_path.resolve()), config_path.stat().st_mtime_ns))
         
         # 处理环境变量
         config = self._process_env_vars(config)
         return config
     
-    def _process_env_vars(self, config: Dict) -> Dict:
-        """递归处理环境变量"""
-        if isinstance(config, dict):
-            return {k: self._process_env_vars(v) for k, v in config.items()}
-        elif isinstance(config, list):
-            return [self._process_env_vars(item) for item in config]
-        elif isinstance(config, str) and config.startswith("${") and config.endswith("}"):
-            env_var = config[2:-1]
-            return os.environ.get(env_var, config)
+    def _process_env_vars(self, config: Any) -> Any:
+        """原地替换配置中的环境变量，支持字符串内的部分替换（如 "Bearer ${TOKEN}"）"""
+        if isinstance(config, str):
+            return _ENV_RE.sub(_expand_env, config)
+        
+        # 用显式栈代替递归，只改写含占位符的字符串
+        stack = [config]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                items = node.items()
+            elif isinstance(node, list):
+                items = enumerate(node)
+            else:
+                continue
+            for key, value in items:
+                if isinstance(value, (dict, list)):
+                    stack.append(value)
+                elif isinstance(value, str) and "${" in value:
+                    node[key] = _ENV_RE.sub(_expand_env, value)
         return config
     
     def _init_checkers(self) -> None:
@@ -61,27 +161,39 @@ class APIRateGuardian:
                 provider = api_config.get("provider", "")
                 api_key = api_config.get("api_key", "")
                 
-                if not api_key:
-                    print(f"警告: {provider} 缺少 API Key")
+                if api_config.get("mode") == "passive":
+                    # 被动模式只读取业务请求的响应头，不需要 API Key
+                    header_kwargs = {k: api_config[k] for k in ("limit_header", "remaining_header", "reset_header")
+                                     if k in api_config}
+                    checker = PassiveChecker(provider, **header_kwargs)
+                elif not api_key:
+                    log.warning("警告: %s 缺少 API Key", provider)
                     continue
+                else:
+                    # 获取额外的配置参数
+                    extra_kwargs = {}
+                    if provider == "openai":
+                        extra_kwargs["organization"] = api_config.get("organization")
+                    elif provider == "minimax":
+                        extra_kwargs["base_url"] = api_config.get("base_url")
+                    elif provider == "anthropic":
+                        extra_kwargs["model"] = api_config.get("model")
+                    
+                    checker = get_checker(provider, api_key, **extra_kwargs)
                 
-                # 获取额外的配置参数
-                extra_kwargs = {}
-                if provider == "openai":
-                    extra_kwargs["organization"] = api_config.get("organization")
-                elif provider == "minimax":
-                    extra_kwargs["base_url"] = api_config.get("base_url")
-                
-                checker = get_checker(provider, api_key, **extra_kwargs)
                 checker.threshold = api_config.get("threshold", 80)
                 checker.check_interval = api_config.get("check_interval", 60)
+                checker.min_interval = api_config.get("min_interval", checker.check_interval)
+                checker.max_interval = api_config.get("max_interval", checker.check_interval * 10)
+                checker._next_interval = checker.check_interval
                 checker.name = api_config.get("name", provider)
                 
                 self.checkers.append(checker)
-                print(f"✓ 已添加 {checker.name} 检查器")
+                self._history[id(checker)] = UsageHistory()
+                log.info("✓ 已添加 %s 检查器", checker.name)
                 
             except Exception as e:
-                print(f"✗ 添加 {api_config.get('name', 'unknown')} 失败: {e}")
+                log.error("✗ 添加 %s 失败: %s", api_config.get('name', 'unknown'), e)
     
     def _init_notifiers(self) -> None:
         """初始化通知器"""
@@ -94,96 +206,203 @@ class APIRateGuardian:
             notifier = create_notifier({**notifier_config, "type": notifier_type})
             if notifier:
                 self.notification_manager.add_notifier(notifier)
-                print(f"✓ 已添加 {notifier_type} 通知器")
+                log.info("✓ 已添加 %s 通知器", notifier_type)
     
-    def _check_and_notify(self, checker: BaseChecker) -> None:
+    async def _check_and_notify(self, client: httpx.AsyncClient, checker: BaseChecker) -> None:
         """检查并通知"""
         try:
-            result = checker.check()
+            result = await checker.check(client)
             
             if result.get("status") == "error":
-                print(f"✗ {checker.name} 检查失败: {result.get('error')}")
+                checker.backoff()
+                checker.defer_until(result.get("next_poll_epoch"))
+                log.warning("✗ %s 检查失败: %s", checker.name, result.get('error'))
                 return
             
             usage = result.get("usage_percent", 0)
+            # 缓存命中不是新的采样点，重复记录会压平趋势斜率
+            if not result.get("cached"):
+                self._history[id(checker)].append(usage)
+            checker.update_interval(usage)
+            checker.defer_until(result.get("next_poll_epoch"))
             
-            # 检查是否超过阈值
-            if usage >= checker.threshold:
-                current_time = time.time()
-                last_time = self._last_warning.get(checker.name, 0)
+            rising = False
+            if usage < checker.threshold:
+                # 未超过阈值：清除超限预警记录，之后再次超限会立即预警
+                self._last_warning.pop(id(checker), None)
                 
-                # 5分钟内不重复警告
-                if current_time - last_time > 300:
-                    message = f"""
-API: {checker.name}
-使用率: {usage:.1f}%
-剩余: {result.get('remaining', 'unknown')}
-限制: {result.get('limit', 'unknown')}
-
-时间: {time.strftime('%Y-%m-%d %H:%M:%S')}
-"""
-                    self.notification_manager.send(
-                        title=f"API 限流预警 - {checker.name}",
-                        message=message,
-                        level="warning" if usage < 90 else "critical"
-                    )
-                    self._last_warning[checker.name] = current_time
-                    print(f"⚠️ {checker.name} 使用率 {usage:.1f}% 已预警!")
-            else:
-                print(f"✓ {checker.name} 使用率: {usage:.1f}%")
+                projected = self._projected_usage(checker)
+                if projected < checker.threshold - TREND_HYSTERESIS:
+                    self._last_trend_warning.pop(id(checker), None)
+                if projected < checker.threshold:
+                    log.info("✓ %s 使用率: %.1f%%", checker.name, usage)
+                    return
+                rising = True
+            
+            if not await self._claim_cooldown(self._last_trend_warning if rising else self._last_warning, checker):
+                return
+            
+            message = _WARNING_TEMPLATE.format_map({
+                "name": checker.name,
+                "usage": usage,
+                "remaining": result.get('remaining', 'unknown'),
+                "limit": result.get('limit', 'unknown'),
+                "ts": _format_timestamp(int(time.time())),
+            })
+            self._dispatch(self.notification_manager.send(
+                title=f"API 使用率上升预警 - {checker.name}" if rising else f"API 限流预警 - {checker.name}",
+                message=message,
+                level="warning" if usage < 90 else "critical"
+            ))
+            log.warning("⚠️ %s 使用率 %.1f%% 已预警!", checker.name, usage)
                 
         except Exception as e:
-            print(f"✗ {checker.name} 检查异常: {e}")
+            checker.backoff()
+            log.error("✗ %s 检查异常: %s", checker.name, e)
+    
+    async def _claim_cooldown(self, last_warning: Dict[int, float], checker: BaseChecker) -> bool:
+        """5分钟内同一类预警不重复发送；先登记预警时间再发送，发送期间的其它检查不会重复预警"""
+        async with self._warning_lock:
+            current_time = time.monotonic()
+            last_time = last_warning.get(id(checker))
+            if last_time is not None and current_time - last_time <= 300:
+                return False
+            last_warning[id(checker)] = current_time
+            return True
+    
+    def _dispatch(self, notification: Awaitable[None]) -> None:
+        """在后台发送通知，慢的通知渠道不会拖住调度循环；保留引用以便退出前等待发送完成"""
+        task = asyncio.ensure_future(notification)
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+    
+    def _projected_usage(self, checker: BaseChecker) -> float:
+        """按最近的使用率趋势，外推 TREND_HORIZON 次检查之后的使用率"""
+        samples = self._history[id(checker)].values()[-TREND_WINDOW:]
+        if samples.size < TREND_HORIZON:
+            return float(samples[-1]) if samples.size else 0.0
+        _, slope, _ = trend(samples, int(checker.threshold))
+        return float(samples[-1]) + slope * TREND_HORIZON
+    
+    def history(self, checker: BaseChecker) -> UsageHistory:
+        """获取检查器的使用率历史"""
+        return self._history[id(checker)]
+    
+    def find_checker(self, name: str) -> Optional[BaseChecker]:
+        """按配置中的 name 查找检查器，用于在业务代码中拿到 PassiveChecker 并调用 ingest()"""
+        return next((c for c in self.checkers if c.name == name), None)
     
-    def _monitor_loop(self, checker: BaseChecker) -> None:
-        """监控循环"""
+    async def tick(self) -> None:
+        """在同一轮事件循环中批量执行所有到期的检查"""
+        now = time.time()
+        due = [c for c in self._polled if now >= c.next_due]
+        if not due:
+            return
+        
+        await asyncio.gather(*(self._check_and_notify(self._client, c) for c in due), return_exceptions=True)
+        
+        now = time.time()
+        for checker in due:
+            checker.next_due = now + checker._next_interval
+    
+    async def _watch(self, checker: PassiveChecker) -> None:
+        """被动检查器：每次 ingest() 上报后处理一次，不做任何轮询"""
         while self.running:
-            self._check_and_notify(checker)
-            time.sleep(checker.check_interval)
+            await checker.event.wait()
+            checker.event.clear()
+            await self._check_and_notify(self._client, checker)
     
-    def start(self) -> None:
-        """启动监控"""
-        print("\n" + "="*50)
-        print("🔔 API Rate Guardian 启动中...")
-        print("="*50 + "\n")
+    async def _run(self) -> None:
+        """在单个事件循环中运行所有检查器，共享同一个 HTTP 客户端"""
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        self._warning_lock = asyncio.Lock()
         
+        # 连接在各次轮询之间复用；支持 HTTP/2 的服务端多个探测共用一条连接，其余自动回落到 HTTP/1.1
+        limits = httpx.Limits(max_connections=16, max_keepalive_connections=16)
+        async with httpx.AsyncClient(http2=True, timeout=10, limits=limits) as client:
+            self._client = client
+            self.notification_manager.client = client
+            
+            watchers = []
+            for checker in self.checkers:
+                if isinstance(checker, PassiveChecker):
+                    checker.bind(self._loop)
+                    watchers.append(asyncio.ensure_future(self._watch(checker)))
+            
+            while self.running:
+                await self.tick()
+                
+                # 一直睡到最近的检查到期或收到停止信号，空闲时不再每秒唤醒；只有被动检查器时等待停止信号即可
+                timeout = None
+                if self._polled:
+                    timeout = max(min(c.next_due for c in self._polled) - time.time(), 0)
+                try:
+                    await asyncio.wait_for(self._stop_event.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            
+            for watcher in watchers:
+                watcher.cancel()
+            await asyncio.gather(*watchers, return_exceptions=True)
+            
+            # 关闭 HTTP 客户端前等待已发出的通知完成
+            await asyncio.gather(*self._pending, return_exceptions=True)
+    
+    def setup(self) -> None:
+        """初始化检查器和通知器。作为库嵌入时先调用，之后即可用 find_checker() 拿到检查器，再在后台线程 start()"""
+        if self._ready:
+            return
         self._init_checkers()
         self._init_notifiers()
+        self._polled = [c for c in self.checkers if not isinstance(c, PassiveChecker)]
+        self._ready = True
+    
+    def start(self) -> None:
+        """启动监控"""
+        log.info("🔔 API Rate Guardian 启动中...")
+        
+        self.setup()
         
         if not self.checkers:
-            print("❌ 没有可用的 API 检查器")
+            log.error("❌ 没有可用的 API 检查器")
             sys.exit(1)
         
-        print("\n" + "-"*50)
-        print("🚀 开始监控...")
-        print("-"*50 + "\n")
+        log.info("🚀 开始监控...")
         
         self.running = True
         
-        # 启动监控线程
-        for checker in self.checkers:
-            thread = threading.Thread(target=self._monitor_loop, args=(checker,))
-            thread.daemon = True
-            thread.start()
-            self.threads.append(thread)
+        # 首次调用 trend() 会触发 JIT 编译，放在事件循环启动前，避免编译期间阻塞所有检查器
+        warm_up()
         
-        # 等待
+        # 只为本次运行创建事件循环，不修改全局事件循环策略：嵌入宿主应用时 start() 运行在后台线程中
+        loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
         try:
-            while self.running:
-                time.sleep(1)
+            loop.run_until_complete(self._run())
         except KeyboardInterrupt:
             self.stop()
+        finally:
+            # 与 asyncio.run() 一致：取消剩余任务后再关闭事件循环
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+        
+        log.info("✅ 已停止")
+        sys.exit(0)
     
     def stop(self) -> None:
         """停止监控"""
-        print("\n\n🛑 正在停止...")
+        if not self.running:
+            return
+        log.info("🛑 正在停止...")
         self.running = False
         
-        for thread in self.threads:
-            thread.join(timeout=2)
-        
-        print("✅ 已停止")
-        sys.exit(0)
+        # 信号处理函数可能在事件循环之外被调用，通过 call_soon_threadsafe 唤醒调度循环
+        if self._loop is not None and self._stop_event is not None:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
 
 
 def main():
@@ -192,6 +411,8 @@ def main():
     args = parser.parse_args()
     
     guardian = APIRateGuardian(args.config)
+    # 只有命令行入口才接管根日志；作为库嵌入时沿用宿主程序的日志配置
+    _setup_logging(guardian.config.get("logging") or {})
     
     # 处理退出信号
     def signal_handler(sig, frame):
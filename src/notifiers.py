@@ -3,20 +3,25 @@
 """
 import os
 import json
+import time
+import asyncio
+import logging
 import smtplib
-import requests
+import httpx
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List
 
 
+log = logging.getLogger("guardian.notifiers")
+
 class Notifier(ABC):
     """通知器基类"""
     
     @abstractmethod
-    def send(self, title: str, message: str, level: str = "warning") -> bool:
-        """发送通知"""
+    async def send(self, client: httpx.AsyncClient, title: str, message: str, level: str = "warning") -> bool:
+        """发送通知（HTTP 类通知复用调用方传入的 HTTP 客户端）"""
         pass
 
 
@@ -28,7 +33,7 @@ class TelegramNotifier(Notifier):
         self.chat_id = chat_id
         self.api_url = f"https://api.telegram.org/bot{token}"
     
-    def send(self, title: str, message: str, level: str = "warning") -> bool:
+    async def send(self, client: httpx.AsyncClient, title: str, message: str, level: str = "warning") -> bool:
         emoji = {
             "warning": "⚠️",
             "critical": "🔴",
@@ -38,18 +43,17 @@ class TelegramNotifier(Notifier):
         text = f"{emoji} *{title}*\n\n{message}"
         
         try:
-            resp = requests.post(
+            resp = await client.post(
                 f"{self.api_url}/sendMessage",
                 json={
                     "chat_id": self.chat_id,
                     "text": text,
                     "parse_mode": "Markdown"
-                },
-                timeout=10
+                }
             )
             return resp.status_code == 200
         except Exception as e:
-            print(f"Telegram 发送失败: {e}")
+            log.error("Telegram 发送失败: %s", e)
             return False
 
 
@@ -65,7 +69,12 @@ class EmailNotifier(Notifier):
         self.from_email = from_email
         self.to_email = to_email
     
-    def send(self, title: str, message: str, level: str = "warning") -> bool:
+    async def send(self, client: httpx.AsyncClient, title: str, message: str, level: str = "warning") -> bool:
+        # smtplib 是阻塞的，放到线程池执行，避免卡住事件循环
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._send_blocking, title, message, level)
+    
+    def _send_blocking(self, title: str, message: str, level: str) -> bool:
         try:
             msg = MIMEMultipart()
             msg["From"] = self.from_email
@@ -81,14 +90,14 @@ class EmailNotifier(Notifier):
 """
             msg.attach(MIMEText(body, "plain"))
             
-            with smtplib.SMTP(self.smtp_host, self.smtp_port) as server:
+            with smtplib.SMTP(self.smtp_host, self.smtp_port, timeout=10) as server:
                 server.starttls()
                 server.login(self.username, self.password)
                 server.send_message(msg)
             
             return True
         except Exception as e:
-            print(f"邮件发送失败: {e}")
+            log.error("邮件发送失败: %s", e)
             return False
 
 
@@ -100,7 +109,7 @@ class WebhookNotifier(Notifier):
         self.method = method
         self.headers = headers or {"Content-Type": "application/json"}
     
-    def send(self, title: str, message: str, level: str = "warning") -> bool:
+    async def send(self, client: httpx.AsyncClient, title: str, message: str, level: str = "warning") -> bool:
         payload = {
             "title": title,
             "message": message,
@@ -110,13 +119,13 @@ class WebhookNotifier(Notifier):
         
         try:
             if self.method == "POST":
-                resp = requests.post(self.url, json=payload, headers=self.headers, timeout=10)
+                resp = await client.post(self.url, json=payload, headers=self.headers)
             else:
-                resp = requests.get(self.url, params=payload, headers=self.headers, timeout=10)
+                resp = await client.get(self.url, params=payload, headers=self.headers)
             
             return resp.status_code in [200, 201]
         except Exception as e:
-            print(f"Webhook 发送失败: {e}")
+            log.error("Webhook 发送失败: %s", e)
             return False
 
 
@@ -126,26 +135,26 @@ class BarkNotifier(Notifier):
     def __init__(self, key: str, server: str = "api.day.app"):
         self.key = key
         self.server = server
+        self.url = f"https://{server}/push"
     
-    def send(self, title: str, message: str, level: str = "warning") -> bool:
+    async def send(self, client: httpx.AsyncClient, title: str, message: str, level: str = "warning") -> bool:
         try:
-            url = f"https://{self.server}/push"
-            resp = requests.post(url, json={
+            resp = await client.post(self.url, json={
                 "title": title,
                 "body": message,
                 "key": self.key,
                 "level": level
-            }, timeout=10)
+            })
             return resp.status_code == 200
         except Exception as e:
-            print(f"Bark 发送失败: {e}")
+            log.error("Bark 发送失败: %s", e)
             return False
 
 
 class ConsoleNotifier(Notifier):
     """控制台通知器（用于调试）"""
     
-    def send(self, title: str, message: str, level: str = "warning") -> bool:
+    async def send(self, client: httpx.AsyncClient, title: str, message: str, level: str = "warning") -> bool:
         emoji = {"warning": "⚠️", "critical": "🔴", "info": "ℹ️"}.get(level, "ℹ️")
         print(f"{emoji} {title}: {message}")
         return True
@@ -155,53 +164,60 @@ class NotificationManager:
     """通知管理器"""
     
     def __init__(self):
-        self.notifiers = []
+        self.notifiers: List[Notifier] = []
+        self.client: Optional[httpx.AsyncClient] = None  # 由 APIRateGuardian 设置
     
     def add_notifier(self, notifier: Notifier) -> None:
         self.notifiers.append(notifier)
     
-    def send(self, title: str, message: str, level: str = "warning") -> None:
-        for notifier in self.notifiers:
-            try:
-                notifier.send(title, message, level)
-            except Exception as e:
-                print(f"通知失败: {e}")
+    async def send(self, title: str, message: str, level: str = "warning") -> None:
+        """并发发送到所有通知器，慢的通知器不会拖住其它通知器"""
+        results = await asyncio.gather(
+            *(notifier.send(self.client, title, message, level) for notifier in self.notifiers),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                log.error("通知失败: %s", result)
+
+
+# 通知类型 -> 根据配置构造通知器
+_NOTIFIER_BUILDERS = {
+    "telegram": lambda config: TelegramNotifier(
+        token=config["token"],
+        chat_id=config["chat_id"]
+    ),
+    "email": lambda config: EmailNotifier(
+        smtp_host=config["smtp_host"],
+        smtp_port=config.get("smtp_port", 587),
+        username=config["username"],
+        password=config["password"],
+        from_email=config["from_email"],
+        to_email=config["to_email"]
+    ),
+    "webhook": lambda config: WebhookNotifier(
+        url=config["url"],
+        method=config.get("method", "POST"),
+        headers=config.get("headers")
+    ),
+    "bark": lambda config: BarkNotifier(
+        key=config["key"],
+        server=config.get("server", "api.day.app")
+    ),
+    "console": lambda config: ConsoleNotifier(),
+}
 
 
 def create_notifier(config: Dict) -> Optional[Notifier]:
     """工厂函数：创建通知器"""
     notifier_type = config.get("type", "").lower()
     
-    if notifier_type == "telegram":
-        return TelegramNotifier(
-            token=config["token"],
-            chat_id=config["chat_id"]
-        )
-    elif notifier_type == "email":
-        return EmailNotifier(
-            smtp_host=config["smtp_host"],
-            smtp_port=config.get("smtp_port", 587),
-            username=config["username"],
-            password=config["password"],
-            from_email=config["from_email"],
-            to_email=config["to_email"]
-        )
-    elif notifier_type == "webhook":
-        return WebhookNotifier(
-            url=config["url"],
-            method=config.get("method", "POST"),
-            headers=config.get("headers")
-        )
-    elif notifier_type == "bark":
-        return BarkNotifier(
-            key=config["key"],
-            server=config.get("server", "api.day.app")
-        )
-    elif notifier_type == "console":
-        return ConsoleNotifier()
-    else:
-        print(f"未知的通知类型: {notifier_type}")
+    builder = _NOTIFIER_BUILDERS.get(notifier_type)
+    if builder is None:
+        log.warning("未知的通知类型: %s", notifier_type)
         return None
+    
+    return builder(config)
 
 
 if __name__ == "__main__":
@@ -210,4 +226,4 @@ if __name__ == "__main__":
     
     # 控制台通知测试
     notifier = ConsoleNotifier()
-    notifier.send("测试标题", "这是一条测试消息", "warning")
+    asyncio.run(notifier.send(None, "测试标题", "这是一条测试消息", "warning"))